@@ -3,20 +3,736 @@
 """
 
 import os
+import re
+import sys
+import queue
+import logging
+import logging.handlers
+import stat
+import errno
+import gzip
 import json
 import shutil
+import secrets
+import socket
+import time
+import hashlib
+import email.utils
+import operator
+import functools
+import collections
+import tempfile
+import threading
 import mimetypes
 import urllib.parse
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# orjson is optional; when installed it parses and serializes bytes in C
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode()
+    # json.loads takes bytes as well, so there's no need to decode first
+    _loads = json.loads
 
 # Configuration
 DATA_DIR = "rydrive_data"
+UPLOAD_TMP_DIR = "rydrive_tmp"  # Partial files of in-progress uploads
 HOST = "localhost"
 PORT = 8080
+HTTP_THREADS = int(os.environ.get("RYDRIVE_HTTP_THREADS", "32"))  # Max concurrent requests
+REQUEST_TIMEOUT = 60  # Seconds a silent or stalled connection may hold one of those threads
+INDEX_FILE = "index.html"
+LIST_CACHE_SIZE = 256  # Folders whose /api/list response is kept in memory
+DELETE_WORKERS = 4  # Background threads for deleting large folders
+
+# Size of each read when a file is copied to the socket without sendfile
+SENDFILE_CHUNK = 1 << 20
+# Size of each read from the socket while streaming an upload to disk
+UPLOAD_CHUNK = 1 << 20
+# Sends larger than this ask the kernel to prefetch their first READAHEAD_MAX bytes
+READAHEAD_MIN = 16 * 1024 * 1024
+READAHEAD_MAX = 64 * 1024 * 1024
+# Upper bound on the header block of a single multipart part
+MAX_PART_HEADERS = 16 * 1024
+# How much of an out-of-order upload (file before "path") is held in RAM
+SPOOL_MAX_MEMORY = 1 << 20
+# Fixed socket send buffer per connection, or 0 to leave the kernel's
+# autotuning in charge. On Linux a fixed size disables autotuning and is
+# clamped to net.core.wmem_max (about 208 KiB by default), while autotuning
+# can grow up to tcp_wmem's max (typically 4 MiB); only set this with a
+# raised wmem_max
+SOCKET_SNDBUF = 0
+# Folders with fewer entries than this are deleted inline; bigger ones become jobs
+SYNC_DELETE_LIMIT = 16
+# Finished delete jobs remembered for polling before the oldest are forgotten
+MAX_DELETE_JOBS = 256
+# Upload folders remembered as existing, so repeat uploads skip makedirs
+KNOWN_DIRS_SIZE = 1024
+# Chunked uploads and upload temp files in UPLOAD_TMP_DIR nobody has written
+# to for this many seconds are deleted, checking at most once per
+# STALE_UPLOAD_SWEEP seconds
+STALE_UPLOAD_AGE = 24 * 3600
+STALE_UPLOAD_SWEEP = 3600
+
+# Request log; main() drains it to stdout on a background thread so request
+# threads only enqueue records
+_log = logging.getLogger("rydrive")
+
+# Resolved once at import instead of on every request
+_DATA_ROOT = os.path.realpath(DATA_DIR)
+_DATA_ROOT_STR = _DATA_ROOT + os.sep
+
+# Sort key for DirEntry objects; attrgetter runs in C, a lambda doesn't
+_BY_NAME = operator.attrgetter("name")
+
+# Resolved folder path -> (folder st_mtime_ns, serialized /api/list body,
+# generation), least recently used first
+_LIST_CACHE = collections.OrderedDict()
+# Requests run on several threads and OrderedDict reordering isn't atomic
+_LIST_CACHE_LOCK = threading.Lock()
+# Bumped by every _list_cache_drop; folders not in the cache count as the
+# newest generation evicted so far
+_list_gen = 0
+_list_gen_floor = 0
+
+# Resolved folder paths known to exist -> their st_dev, least recently used first
+_KNOWN_DIRS = collections.OrderedDict()
+_KNOWN_DIRS_LOCK = threading.Lock()
+
+# Background deletes: job id -> Future, oldest first
+_DELETE_POOL = ThreadPoolExecutor(max_workers=DELETE_WORKERS, thread_name_prefix="rydrive-delete")
+_JOBS = collections.OrderedDict()
+_JOBS_LOCK = threading.Lock()
+
+# Chunked uploads in progress: upload id -> [total size, sorted merged
+# (start, end) byte ranges received so far]
+_CHUNKED = {}
+_CHUNKED_LOCK = threading.Lock()
+_next_part_sweep = 0.0
+
+# Body of every successful mutation, encoded once
+_OK_JSON = b'{"success":true}'
+
+# Types for the formats the web viewer handles; anything else goes through mimetypes
+_MIME_TYPES = {
+    '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
+    '.webp': 'image/webp', '.svg': 'image/svg+xml',
+    '.mp4': 'video/mp4', '.webm': 'video/webm',
+    '.mp3': 'audio/mpeg', '.wav': 'audio/wav', '.ogg': 'audio/ogg', '.m4a': 'audio/mp4',
+    '.pdf': 'application/pdf', '.txt': 'text/plain; charset=utf-8',
+}
+
+# Name prefix of uploads still being written, in UPLOAD_TMP_DIR or, when that
+# is on another filesystem, next to their destination
+_UPLOAD_TMP_PREFIX = ".rydrive-upload-"
+
+_UPLOAD_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Content-Disposition line of a multipart part's headers, and its quoted
+# parameters, which may come in any order
+_CD_RE = re.compile(rb'^Content-Disposition:([^\r\n]*)', re.IGNORECASE | re.MULTILINE)
+_CD_PARAM_RE = re.compile(rb';\s*([\w*-]+)="([^"]*)"')
+
+
+def _load_index():
+    """Read the web interface once; None if the file is missing"""
+    try:
+        with open(INDEX_FILE, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+# The page never changes while the server runs, so it is read, compressed
+# and tagged once and the same bytes are reused for every request
+_INDEX_HTML = _load_index()
+_INDEX_GZ = gzip.compress(_INDEX_HTML, compresslevel=9) if _INDEX_HTML is not None else None
+_INDEX_ETAG = hashlib.blake2b(_INDEX_HTML, digest_size=8).hexdigest() if _INDEX_HTML is not None else None
+
+
+def _etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against a quoted ETag"""
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+_PARDIR_PREFIX = os.pardir + os.sep
+
+
+def _resolve(relative_path):
+    """Map a client path to its real path inside DATA_DIR
+
+    The path is normalized lexically first: ".." escapes are rejected without
+    touching the filesystem, and spellings like "a//b/../c" share one entry
+    in the realpath cache.
+    """
+    norm = os.path.normpath(relative_path.lstrip("/"))
+    if norm == os.pardir or norm.startswith(_PARDIR_PREFIX):
+        raise ValueError("Invalid path")
+    return _realpath_in_root(norm)
+
+
+@functools.lru_cache(maxsize=2048)
+def _realpath_in_root(norm):
+    """Real path of a normalized relative path, checked to stay inside DATA_DIR
+
+    Browsing keeps hitting the same few folders, so results are cached; the
+    handlers that change the tree call _realpath_in_root.cache_clear().
+    Symlinks inside the tree can still point outside it, which is why the
+    realpath is needed even for paths that look clean.
+    """
+    full_path = os.path.realpath(os.path.join(_DATA_ROOT_STR, norm))
+
+    # Compare against the root plus separator so "data2" doesn't pass for "data"
+    if not (full_path == _DATA_ROOT or full_path.startswith(_DATA_ROOT_STR)):
+        raise ValueError("Invalid path")
+    return full_path
+
+
+def _list_cache_get(folder, mtime_ns):
+    """Cached listing body for folder (None if stale) and its generation
+
+    Adding, removing or renaming an entry bumps the folder's mtime, so a
+    matching mtime means the cached listing is still accurate. The generation
+    goes back to _list_cache_put with a freshly scanned body.
+    """
+    with _LIST_CACHE_LOCK:
+        hit = _LIST_CACHE.get(folder)
+        if hit is None:
+            return None, _list_gen_floor
+        if hit[0] != mtime_ns:
+            return None, hit[2]
+        _LIST_CACHE.move_to_end(folder)
+        return hit[1], hit[2]
+
+
+def _list_cache_put(folder, mtime_ns, body, gen):
+    """Cache a scanned listing unless the folder was dropped since gen was read"""
+    with _LIST_CACHE_LOCK:
+        hit = _LIST_CACHE.get(folder)
+        if (_list_gen_floor if hit is None else hit[2]) != gen:
+            return
+        _LIST_CACHE[folder] = (mtime_ns, body, gen)
+        _LIST_CACHE.move_to_end(folder)
+        _list_cache_trim()
+
+
+def _list_cache_drop(folder):
+    """Forget a folder's listing, for changes mtime doesn't catch (overwrites)
+
+    The entry stays behind with a new generation and no body, so a scan that
+    started before the drop can't put its stale listing back.
+    """
+    global _list_gen
+    with _LIST_CACHE_LOCK:
+        _list_gen += 1
+        _LIST_CACHE[folder] = (None, None, _list_gen)
+        _LIST_CACHE.move_to_end(folder)
+        _list_cache_trim()
+
+
+def _list_cache_trim():
+    """Evict least recently used entries past LIST_CACHE_SIZE; caller holds the lock"""
+    global _list_gen_floor
+    while len(_LIST_CACHE) > LIST_CACHE_SIZE:
+        _, evicted = _LIST_CACHE.popitem(last=False)
+        # Folders missing from the cache share the newest evicted generation
+        _list_gen_floor = max(_list_gen_floor, evicted[2])
+
+
+def _ensure_dir(path):
+    """os.makedirs(path) unless the folder is already known to exist; returns its st_dev"""
+    with _KNOWN_DIRS_LOCK:
+        if path in _KNOWN_DIRS:
+            _KNOWN_DIRS.move_to_end(path)
+            return _KNOWN_DIRS[path]
+    os.makedirs(path, exist_ok=True)
+    dev = os.stat(path).st_dev
+    with _KNOWN_DIRS_LOCK:
+        _KNOWN_DIRS[path] = dev
+        while len(_KNOWN_DIRS) > KNOWN_DIRS_SIZE:
+            _KNOWN_DIRS.popitem(last=False)
+    return dev
+
+
+@functools.lru_cache(maxsize=None)
+def _upload_tmp_dev():
+    """st_dev of UPLOAD_TMP_DIR, creating it if needed"""
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    return os.stat(UPLOAD_TMP_DIR).st_dev
+
+
+def _forget_dirs(path):
+    """Drop path and everything below it from the known-folder cache"""
+    prefix = path + os.sep
+    with _KNOWN_DIRS_LOCK:
+        for known in [d for d in _KNOWN_DIRS if d == path or d.startswith(prefix)]:
+            del _KNOWN_DIRS[known]
+
+
+def _is_small_tree(path, limit=SYNC_DELETE_LIMIT):
+    """True if the folder holds fewer than limit entries in total
+
+    Stops counting as soon as the limit is reached, so a huge tree costs no
+    more than a small one to classify.
+    """
+    seen = 0
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                seen += 1
+                if seen >= limit:
+                    return False
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+    return True
+
+
+_DIR_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_NOFOLLOW", 0)
+_FD_RMTREE = (
+    os.open in os.supports_dir_fd and os.unlink in os.supports_dir_fd
+    and os.rmdir in os.supports_dir_fd and os.scandir in os.supports_fd
+)
+
+
+def _rmtree_fd(dir_fd):
+    """Empty the folder open as dir_fd, addressing every entry relative to it"""
+    with os.scandir(dir_fd) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            # O_NOFOLLOW makes a symlink swapped in meanwhile fail to open
+            # instead of being followed out of the tree
+            child_fd = os.open(entry.name, _DIR_OPEN_FLAGS, dir_fd=dir_fd)
+            try:
+                _rmtree_fd(child_fd)
+            finally:
+                os.close(child_fd)
+            os.rmdir(entry.name, dir_fd=dir_fd)
+        else:
+            os.unlink(entry.name, dir_fd=dir_fd)
+
+
+def _rmtree(path):
+    """Delete a folder tree
+
+    Entry types come straight from scandir's d_type and each unlink/rmdir
+    is relative to its parent's fd, so no entry is stat'ed or path-resolved
+    from the root again. shutil.rmtree covers platforms without dir_fd.
+    """
+    if not _FD_RMTREE:
+        shutil.rmtree(path)
+        return
+    dir_fd = os.open(path, _DIR_OPEN_FLAGS)
+    try:
+        _rmtree_fd(dir_fd)
+    finally:
+        os.close(dir_fd)
+    os.rmdir(path)
+
+
+def _delete_path(full_path):
+    """Remove a file or folder tree and forget everything cached about it"""
+    if os.path.isdir(full_path):
+        _rmtree(full_path)
+    else:
+        os.unlink(full_path)
+    _realpath_in_root.cache_clear()
+    _forget_dirs(full_path)
+    _list_cache_drop(full_path)
+    _list_cache_drop(os.path.dirname(full_path))
+
+
+def _submit_delete(full_path):
+    """Queue a background delete and return its job id"""
+    job_id = secrets.token_hex(8)
+    with _JOBS_LOCK:
+        _JOBS[job_id] = _DELETE_POOL.submit(_delete_path, full_path)
+        # Forget the oldest finished jobs nobody came back for
+        for old_id in list(_JOBS):
+            if len(_JOBS) <= MAX_DELETE_JOBS:
+                break
+            if _JOBS[old_id].done():
+                del _JOBS[old_id]
+    return job_id
+
+
+def _chunk_received(upload_id, start, end, total):
+    """Record that bytes [start, end) of a chunked upload are on disk"""
+    with _CHUNKED_LOCK:
+        entry = _CHUNKED.setdefault(upload_id, [total, []])
+        if entry[0] != total:
+            raise ValueError("Content-Range total changed during the upload")
+        merged = []
+        for lo, hi in sorted(entry[1] + [(start, end)]):
+            if merged and lo <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+            else:
+                merged.append((lo, hi))
+        entry[1] = merged
+
+
+def _chunk_covered(upload_id, size):
+    """True if every byte of a size-byte chunked upload has been received"""
+    with _CHUNKED_LOCK:
+        entry = _CHUNKED.get(upload_id)
+        return entry is not None and entry[0] == size and entry[1] == [(0, size)]
+
+
+def _sweep_stale_parts():
+    """Delete chunked uploads and left-over upload temp files idle for STALE_UPLOAD_AGE"""
+    cutoff = time.time() - STALE_UPLOAD_AGE
+    try:
+        it = os.scandir(UPLOAD_TMP_DIR)
+    except FileNotFoundError:
+        return
+    with it:
+        for entry in it:
+            is_part = entry.name.endswith(".part")
+            if not (is_part or entry.name.startswith(_UPLOAD_TMP_PREFIX)):
+                continue
+            try:
+                # Not cached by scandir for regular files, so this really stats
+                # and can race with a completion renaming the part away
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            if is_part:
+                with _CHUNKED_LOCK:
+                    _CHUNKED.pop(entry.name[:-len(".part")], None)
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def _maybe_sweep_parts():
+    """Queue _sweep_stale_parts if the last one was long enough ago"""
+    global _next_part_sweep
+    now = time.monotonic()
+    with _CHUNKED_LOCK:
+        if now < _next_part_sweep:
+            return
+        _next_part_sweep = now + STALE_UPLOAD_SWEEP
+    _DELETE_POOL.submit(_sweep_stale_parts)
+
+
+@functools.lru_cache(maxsize=512)
+def _mime_for_ext(ext):
+    """Content-Type for a lower-cased extension; a server sees few distinct ones"""
+    mime_type = _MIME_TYPES.get(ext)
+    if mime_type is None:
+        mime_type = mimetypes.guess_type("x" + ext)[0] or "application/octet-stream"
+    return mime_type
+
+
+def _guess_mime(path):
+    """Content-Type for a file, by extension"""
+    return _mime_for_ext(os.path.splitext(path)[1].lower())
+
+
+def _parse_range(header, size):
+    """Turn a Range header into an inclusive (start, end) pair
+
+    Returns None when the whole file should be sent (no header, or a form we
+    don't serve such as multiple ranges) and raises ValueError when the
+    range can't be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix form: "bytes=-N" is the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def _disposition_params(headers):
+    """Quoted Content-Disposition parameters of a part's header block, by lower-cased name"""
+    match = _CD_RE.search(headers)
+    if match is None:
+        return {}
+    return {key.lower(): value for key, value in _CD_PARAM_RE.findall(match.group(1))}
+
+
+class MultipartParser:
+    """Incremental multipart/form-data parser
+
+    Raw body chunks are fed to write() as they come off the socket and the
+    callbacks fire as soon as part headers and data are recognised, so at
+    most one chunk plus a boundary's worth of bytes is ever held in memory.
+    on_part_data receives a memoryview into the parser's buffer that is only
+    valid for the duration of the call.
+    """
+
+    def __init__(self, boundary, on_part_begin, on_part_data, on_part_end):
+        # Seeding the buffer with CRLF lets the first boundary match the
+        # same delimiter as every later one
+        self._delim = b"\r\n--" + boundary
+        self._buf = bytearray(b"\r\n")
+        self._state = "preamble"
+        # Where the next header-terminator search starts, so slow-arriving
+        # headers aren't rescanned from the beginning on every write
+        self._header_scan = 0
+        self._on_part_begin = on_part_begin
+        self._on_part_data = on_part_data
+        self._on_part_end = on_part_end
+
+    def write(self, chunk):
+        buf = self._buf
+        buf += chunk
+        while True:
+            if self._state in ("preamble", "body"):
+                idx = buf.find(self._delim)
+                if idx < 0:
+                    # Hold back anything that could be the start of a delimiter
+                    keep = len(buf) - len(self._delim) + 1
+                    if keep > 0:
+                        if self._state == "body":
+                            self._emit_data(keep)
+                        del buf[:keep]
+                    return
+                if self._state == "body":
+                    if idx:
+                        self._emit_data(idx)
+                    self._on_part_end()
+                del buf[:idx + len(self._delim)]
+                self._state = "delimiter"
+            elif self._state == "delimiter":
+                if len(buf) < 2:
+                    return
+                if buf[:2] == b"--":
+                    self._state = "done"
+                    continue
+                if buf[:2] != b"\r\n":
+                    raise ValueError("Malformed multipart body")
+                del buf[:2]
+                self._state = "headers"
+                self._header_scan = 0
+            elif self._state == "headers":
+                idx = buf.find(b"\r\n\r\n", self._header_scan)
+                if idx < 0:
+                    if len(buf) > MAX_PART_HEADERS:
+                        raise ValueError("Multipart part headers too large")
+                    self._header_scan = max(len(buf) - 3, 0)
+                    return
+                self._on_part_begin(bytes(buf[:idx]))
+                del buf[:idx + 4]
+                self._state = "body"
+            else:
+                # Epilogue after the closing boundary is ignored
+                buf.clear()
+                return
+
+    def _emit_data(self, end):
+        """Pass buf[:end] to on_part_data without copying it"""
+        # The view has to be released before the bytearray can be resized again
+        with memoryview(self._buf) as view:
+            data = view[:end]
+            try:
+                self._on_part_data(data)
+            finally:
+                data.release()
+
+    def close(self):
+        if self._state != "done":
+            raise ValueError("Incomplete multipart body")
+
+
+def _open_for_write(path, size_hint=None):
+    """Open path as a raw, truncated fd, preallocating size_hint bytes if given"""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_CLOEXEC", 0) | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o644)
+    if size_hint and hasattr(os, "posix_fallocate"):
+        # Reserve the extents in one go instead of growing the file per write
+        try:
+            os.posix_fallocate(fd, 0, size_hint)
+        except OSError:
+            pass
+    return fd
+
+
+def _write_all(fd, data):
+    """os.write() until every byte of data has been written"""
+    with memoryview(data) as view:
+        while view:
+            view = view[os.write(fd, view):]
+
+
+def _finish_write(fd, length):
+    """Trim any preallocation, flush to disk and drop the pages from the cache
+
+    A finished upload is rarely read back straight away, so there's no point
+    letting it push other files out of the page cache.
+    """
+    os.ftruncate(fd, length)
+    os.fsync(fd)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+class UploadReceiver:
+    """MultipartParser callbacks for /api/upload
+
+    Each "file" part is written under a temporary name in its destination
+    folder and renamed over the real name when the part ends, so readers never
+    see a half-written file and a failed upload leaves an existing one alone.
+    File parts that arrive before the "path" field are spooled and written out
+    once the destination is known. size_hint (the request's Content-Length)
+    bounds the file size and is used to preallocate.
+    """
+
+    def __init__(self, resolve, size_hint=None):
+        self._resolve = resolve
+        self._size_hint = size_hint
+        self.path = None
+        self.folder = None
+        self.saved = 0
+        self._field = None
+        self._value = bytearray()
+        self._filename = None
+        self._fd = None
+        self._tmp = None
+        self._spool = None
+        self._spooled = []
+        self._written = 0
+
+    def _open_destination(self):
+        folder = self._resolve(self.path or "")
+        dev = _ensure_dir(folder)
+        self.folder = folder
+        # In UPLOAD_TMP_DIR the stale sweep reclaims what a crash leaves
+        # behind; another filesystem needs the file next to its destination
+        # so that finishing is still a rename
+        tmp_dir = UPLOAD_TMP_DIR if dev == _upload_tmp_dev() else folder
+        self._tmp = os.path.join(tmp_dir, _UPLOAD_TMP_PREFIX + secrets.token_hex(8))
+        try:
+            self._fd = _open_for_write(self._tmp, self._size_hint)
+        except FileNotFoundError:
+            # Removed outside the server since it was cached: create it again
+            _forget_dirs(folder)
+            _ensure_dir(folder)
+            os.makedirs(tmp_dir, exist_ok=True)
+            self._fd = _open_for_write(self._tmp, self._size_hint)
+
+    def _commit(self):
+        """Flush the open file and rename it over its destination"""
+        _finish_write(self._fd, self._written)
+        os.close(self._fd)
+        self._fd = None
+        dest = os.path.join(self.folder, self._filename)
+        try:
+            os.replace(self._tmp, dest)
+        except FileNotFoundError:
+            # The folder went away outside the server during the upload
+            _forget_dirs(self.folder)
+            _ensure_dir(self.folder)
+            os.replace(self._tmp, dest)
+        self._tmp = None
+        self.saved += 1
+
+    def part_begin(self, headers):
+        params = _disposition_params(headers)
+        self._field = params.get(b"name", b"").decode("utf-8", "replace")
+        if self._field == "file":
+            filename = params.get(b"filename", b"").decode("utf-8", "replace")
+            # Keep only the final component so the name cannot climb out of the folder
+            filename = os.path.basename(filename.replace("\\", "/"))
+            if filename in ("", ".", ".."):
+                self._field = None
+                return
+            self._filename = filename
+            self._written = 0
+            if self.path is not None:
+                self._open_destination()
+            else:
+                # Small files stay in memory; larger ones roll over to disk
+                self._spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        elif self._field == "path":
+            self._value.clear()
+
+    def part_data(self, data):
+        if self._field == "file":
+            if self._fd is not None:
+                _write_all(self._fd, data)
+            else:
+                self._spool.write(data)
+            self._written += len(data)
+        elif self._field == "path":
+            self._value += data
+
+    def part_end(self):
+        if self._field == "path":
+            self.path = self._value.decode()
+        elif self._field == "file":
+            if self._fd is not None:
+                self._commit()
+            else:
+                self._spooled.append((self._filename, self._spool, self._written))
+                self._spool = None
+        self._field = None
+
+    def finish(self):
+        """Write out spooled files; returns False if no file was sent"""
+        while self._spooled:
+            self._filename, spool, self._written = self._spooled[0]
+            self._open_destination()
+            spool.seek(0)
+            while True:
+                chunk = spool.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                _write_all(self._fd, chunk)
+            spool.close()
+            self._spooled.pop(0)
+            self._commit()
+        return self.saved > 0
+
+    def abort(self):
+        """Drop whatever hasn't been put in place yet"""
+        if self._spool is not None:
+            self._spool.close()
+        for _, spool, _ in self._spooled:
+            spool.close()
+        if self._fd is not None:
+            os.close(self._fd)
+        if self._tmp is not None:
+            try:
+                os.unlink(self._tmp)
+            except OSError:
+                pass
 
 
 class RyDriveHandler(BaseHTTPRequestHandler):
+    # Collect the status line, headers and small bodies into one socket write
+    wbufsize = 64 * 1024
+    # Idle connections (e.g. browser preconnects) give their thread back
+    timeout = REQUEST_TIMEOUT
+
+    def setup(self):
+        super().setup()
+        # Short JSON replies shouldn't sit in Nagle's delay waiting for an ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if SOCKET_SNDBUF:
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF)
+
     def _set_headers(self, content_type="text/html", status=200):
         self.send_response(status)
         self.send_header("Content-type", content_type)
@@ -25,13 +741,54 @@ class RyDriveHandler(BaseHTTPRequestHandler):
 
     def _get_full_path(self, relative_path):
         """Convert relative path to full system path safely"""
-        full_path = Path(DATA_DIR) / relative_path.lstrip("/")
-        full_path = full_path.resolve()
-        data_dir_resolved = Path(DATA_DIR).resolve()
-        
-        if not str(full_path).startswith(str(data_dir_resolved)):
-            raise ValueError("Invalid path")
-        return full_path
+        return _resolve(relative_path)
+
+    def _send_file_body(self, f, offset, count, drop_cache=False):
+        """Send count bytes of an open file from offset, zero-copy via sendfile where possible
+
+        With drop_cache the pages are released from the page cache afterwards,
+        for one-shot downloads that shouldn't evict other users' files.
+        """
+        fadvise = count > 0 and hasattr(os, "posix_fadvise")
+        if fadvise:
+            # Let the kernel widen readahead; for big files also start reading
+            # ahead of sendfile, but only a bounded head so memory isn't flooded
+            os.posix_fadvise(f.fileno(), offset, count, os.POSIX_FADV_SEQUENTIAL)
+            if count > READAHEAD_MIN:
+                os.posix_fadvise(f.fileno(), offset, min(count, READAHEAD_MAX), os.POSIX_FADV_WILLNEED)
+
+        # With TCP_CORK (Linux) the buffered headers and the first file bytes
+        # leave in the same segment instead of headers going out alone
+        cork = hasattr(socket, "TCP_CORK")
+        if cork:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            self.wfile.flush()
+            self._copy_file(f, offset, count)
+        finally:
+            if cork:
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+            if fadvise and drop_cache:
+                os.posix_fadvise(f.fileno(), offset, count, os.POSIX_FADV_DONTNEED)
+
+    def _copy_file(self, f, offset, count):
+        """Copy a byte window of f to the socket"""
+        if hasattr(os, "sendfile"):
+            # socket.sendfile() rather than a bare os.sendfile() loop: with a
+            # timeout set the socket is non-blocking underneath, and it waits
+            # for the socket to drain (up to the timeout) instead of failing
+            # with EAGAIN; it also falls back to send() on files sendfile rejects
+            if count:
+                self.connection.sendfile(f, offset, count)
+            return
+        f.seek(offset)
+        while count:
+            buf = f.read(min(count, SENDFILE_CHUNK))
+            if not buf:
+                break
+            self.wfile.write(buf)
+            count -= len(buf)
+        self.wfile.flush()
 
     def do_GET(self):
         parsed_path = urllib.parse.urlparse(self.path)
@@ -45,6 +802,8 @@ class RyDriveHandler(BaseHTTPRequestHandler):
             self._download_file(path[14:])
         elif path.startswith("/api/view/"):
             self._view_file(path[10:])
+        elif path.startswith("/api/job/"):
+            self._job_status(path[9:])
         else:
             self._set_headers(status=404)
             self.wfile.write(b"404 Not Found")
@@ -59,20 +818,55 @@ class RyDriveHandler(BaseHTTPRequestHandler):
             self._create_folder()
         elif path == "/api/delete":
             self._delete_item()
+        elif path == "/api/upload/complete":
+            self._complete_chunked_upload()
+        else:
+            self._set_headers(status=404)
+            self.wfile.write(b"404 Not Found")
+
+    def do_PUT(self):
+        parsed_path = urllib.parse.urlparse(self.path)
+        path = parsed_path.path
+
+        if path == "/api/upload/chunk":
+            self._upload_chunk()
         else:
             self._set_headers(status=404)
             self.wfile.write(b"404 Not Found")
 
     def _serve_index(self):
         """Serve the main HTML interface"""
-        try:
-            with open('index.html', 'r', encoding='utf-8') as f:
-                html_content = f.read()
-            self._set_headers()
-            self.wfile.write(html_content.encode())
-        except FileNotFoundError:
+        if _INDEX_HTML is None:
             self._set_headers(status=404)
             self.wfile.write(b"index.html not found. Please ensure index.html is in the same directory as rydrive.py")
+            return
+
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = _INDEX_GZ
+            etag = f'"{_INDEX_ETAG}-gz"'
+        else:
+            body = _INDEX_HTML
+            etag = f'"{_INDEX_ETAG}"'
+
+        if _etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "public, max-age=3600")
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-type", "text/html")
+        if body is _INDEX_GZ:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "public, max-age=3600")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
 
     def _list_files(self, query):
         """List files and folders in a directory"""
@@ -81,120 +875,260 @@ class RyDriveHandler(BaseHTTPRequestHandler):
 
         try:
             full_path = self._get_full_path(rel_path)
-            items = []
-
-            if full_path.exists() and full_path.is_dir():
-                for item in sorted(full_path.iterdir()):
-                    item_rel_path = str(item.relative_to(Path(DATA_DIR)))
-                    items.append({
-                        "name": item.name,
-                        "type": "folder" if item.is_dir() else "file",
-                        "size": item.stat().st_size if item.is_file() else 0,
-                        "path": item_rel_path
-                    })
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                st = None
+
+            if st is None or not stat.S_ISDIR(st.st_mode):
+                body = _dumps({"items": []})
+            else:
+                body, gen = _list_cache_get(full_path, st.st_mtime_ns)
+                if body is None:
+                    body = _dumps({"items": self._scan_folder(full_path)})
+                    _list_cache_put(full_path, st.st_mtime_ns, body, gen)
 
             self._set_headers("application/json")
-            self.wfile.write(json.dumps({"items": items}).encode())
+            self.wfile.write(body)
         except Exception as e:
             self._set_headers("application/json", 500)
-            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            self.wfile.write(_dumps({"error": str(e)}))
+
+    def _scan_folder(self, full_path):
+        """Build the /api/list items for a folder"""
+        with os.scandir(full_path) as it:
+            entries = sorted(it, key=_BY_NAME)
+
+        # Every entry shares the folder's relative path, so work it out once
+        # and only concatenate the name inside the loop
+        rel_prefix = full_path[len(_DATA_ROOT_STR):]
+        if rel_prefix:
+            rel_prefix += os.sep
+
+        items = []
+        append = items.append
+        for entry in entries:
+            name = entry.name
+            # is_dir()/is_file() answer from the d_type scandir already
+            # read, so only regular files pay for a stat()
+            append({
+                "name": name,
+                "type": "folder" if entry.is_dir() else "file",
+                "size": entry.stat().st_size if entry.is_file() else 0,
+                "path": rel_prefix + name
+            })
+        return items
 
     def _upload_file(self):
-        """Handle file upload"""
-        content_type = self.headers['Content-Type']
-        if 'multipart/form-data' not in content_type:
+        """Handle file upload, streaming the body to disk as it arrives"""
+        content_type = self.headers.get('Content-Type', '')
+        if 'multipart/form-data' not in content_type or 'boundary=' not in content_type:
             self._set_headers(status=400)
             return
 
-        boundary = content_type.split("boundary=")[1].encode()
+        boundary = content_type.split("boundary=")[1].split(";")[0].strip('"').encode()
+        remaining = int(self.headers['Content-Length'])
+        _maybe_sweep_parts()
+        receiver = UploadReceiver(self._get_full_path, remaining)
+        parser = MultipartParser(boundary, receiver.part_begin, receiver.part_data, receiver.part_end)
+
+        # One receive buffer reused for the whole body instead of a new bytes per read
+        chunk = memoryview(bytearray(UPLOAD_CHUNK))
+        try:
+            while remaining:
+                n = self.rfile.readinto(chunk[:min(UPLOAD_CHUNK, remaining)])
+                if not n:
+                    break
+                remaining -= n
+                parser.write(chunk[:n])
+            parser.close()
+
+            if not receiver.finish():
+                self._set_headers(status=400)
+                return
+            _list_cache_drop(receiver.folder)
+
+            self._set_headers("application/json")
+            self.wfile.write(_OK_JSON)
+        except Exception as e:
+            receiver.abort()
+            self._set_headers("application/json", 500)
+            self.wfile.write(_dumps({"error": str(e)}))
+
+    def _chunk_part_path(self, upload_id):
+        """Location of the partial file backing a chunked upload"""
+        if not upload_id or not _UPLOAD_ID_RE.match(upload_id):
+            raise ValueError("Invalid upload id")
+        return os.path.join(UPLOAD_TMP_DIR, f"{upload_id}.part")
+
+    def _upload_chunk(self):
+        """Write one Content-Range slice of a chunked upload at its offset"""
+        try:
+            upload_id = self.headers.get('X-Upload-Id')
+            part_path = self._chunk_part_path(upload_id)
+            match = _CONTENT_RANGE_RE.match(self.headers.get('Content-Range', ''))
+            if not match:
+                raise ValueError("Content-Range required")
+            start, end, total = (int(g) for g in match.groups())
+            remaining = int(self.headers['Content-Length'])
+            if start > end or end >= total or remaining != end - start + 1:
+                raise ValueError("Content-Range does not match the body")
+
+            _maybe_sweep_parts()
+            os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+            # Each request has its own fd, so parallel chunks can seek independently
+            fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+            try:
+                os.lseek(fd, start, os.SEEK_SET)
+                buf = memoryview(bytearray(min(UPLOAD_CHUNK, remaining)))
+                while remaining:
+                    n = self.rfile.readinto(buf[:min(len(buf), remaining)])
+                    if not n:
+                        raise ValueError("Truncated chunk")
+                    remaining -= n
+                    _write_all(fd, buf[:n])
+            finally:
+                os.close(fd)
+            _chunk_received(upload_id, start, end + 1, total)
+
+            self._set_headers("application/json")
+            self.wfile.write(_OK_JSON)
+        except Exception as e:
+            self._set_headers("application/json", 500)
+            self.wfile.write(_dumps({"error": str(e)}))
+
+    def _complete_chunked_upload(self):
+        """Move a fully received chunked upload into its folder"""
         content_length = int(self.headers['Content-Length'])
         body = self.rfile.read(content_length)
+        data = _loads(body)
+
+        try:
+            upload_id = data.get('id')
+            part_path = self._chunk_part_path(upload_id)
+            filename = os.path.basename(data.get('name', '').replace("\\", "/"))
+            if filename in ("", ".", ".."):
+                raise ValueError("File name required")
+            # Every byte must have arrived in some chunk; the file's size alone
+            # would also match when only the last slice was sent
+            if not _chunk_covered(upload_id, data.get('size')):
+                raise ValueError("Upload is incomplete")
 
-        parts = body.split(b'--' + boundary)
-        
-        upload_path = ""
-        file_data = None
-        filename = None
-
-        for part in parts:
-            if b'Content-Disposition' in part:
-                if b'name="path"' in part:
-                    upload_path = part.split(b'\r\n\r\n')[1].split(b'\r\n')[0].decode()
-                elif b'name="file"' in part:
-                    header_end = part.find(b'\r\n\r\n')
-                    file_data = part[header_end+4:]
-                    if file_data.endswith(b'\r\n'):
-                        file_data = file_data[:-2]
-                    
-                    header = part[:header_end].decode()
-                    filename_start = header.find('filename="') + 10
-                    filename_end = header.find('"', filename_start)
-                    filename = header[filename_start:filename_end]
-
-        if file_data and filename:
+            full_path = self._get_full_path(data.get('path', ''))
+            os.makedirs(full_path, exist_ok=True)
+            dest = os.path.join(full_path, filename)
+            if os.path.isdir(dest):
+                raise ValueError("A folder with that name already exists")
             try:
-                full_path = self._get_full_path(upload_path)
-                full_path.mkdir(parents=True, exist_ok=True)
-                
-                file_path = full_path / filename
-                with open(file_path, 'wb') as f:
-                    f.write(file_data)
-
-                self._set_headers("application/json")
-                self.wfile.write(json.dumps({"success": True}).encode())
-            except Exception as e:
-                self._set_headers("application/json", 500)
-                self.wfile.write(json.dumps({"error": str(e)}).encode())
-        else:
-            self._set_headers(status=400)
+                os.replace(part_path, dest)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # UPLOAD_TMP_DIR is on another filesystem: copy next to the
+                # destination first so the final step is still a rename
+                tmp = os.path.join(full_path, _UPLOAD_TMP_PREFIX + secrets.token_hex(8))
+                try:
+                    shutil.move(part_path, tmp)
+                    os.replace(tmp, dest)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.unlink(tmp)
+                    raise
+            with _CHUNKED_LOCK:
+                _CHUNKED.pop(upload_id, None)
+            _list_cache_drop(full_path)
+
+            self._set_headers("application/json")
+            self.wfile.write(_OK_JSON)
+        except Exception as e:
+            self._set_headers("application/json", 500)
+            self.wfile.write(_dumps({"error": str(e)}))
 
     def _download_file(self, rel_path):
         """Download a file"""
-        try:
-            full_path = self._get_full_path(rel_path)
-            
-            if not full_path.exists() or not full_path.is_file():
-                self._set_headers(status=404)
-                self.wfile.write(b"File not found")
-                return
+        self._serve_file(rel_path, attachment=True)
 
-            mime_type, _ = mimetypes.guess_type(str(full_path))
-            if not mime_type:
-                mime_type = "application/octet-stream"
+    def _view_file(self, rel_path):
+        """View a file (for media preview)"""
+        self._serve_file(rel_path)
 
-            self.send_response(200)
-            self.send_header("Content-type", mime_type)
-            self.send_header("Content-Disposition", f'attachment; filename="{full_path.name}"')
-            self.send_header("Content-Length", str(full_path.stat().st_size))
-            self.end_headers()
+    def _not_modified(self, etag, mtime):
+        """Whether the client's cached copy (If-None-Match/If-Modified-Since) is current"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return _etag_matches(if_none_match, etag)
+        since = self.headers.get('If-Modified-Since')
+        if since:
+            try:
+                return int(mtime) <= email.utils.parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
 
-            with open(full_path, 'rb') as f:
-                shutil.copyfileobj(f, self.wfile)
-        except Exception as e:
-            self._set_headers(status=500)
-            self.wfile.write(str(e).encode())
+    def _serve_file(self, rel_path, attachment=False):
+        """Send a file, honouring Range and conditional requests
 
-    def _view_file(self, rel_path):
-        """View a file (for media preview)"""
+        Downloads go out as attachments and are dropped from the page cache
+        afterwards; previews stay cached since media seeking re-reads them.
+        """
         try:
             full_path = self._get_full_path(rel_path)
-            
-            if not full_path.exists() or not full_path.is_file():
+            # One stat answers exists, is-a-file, size and the validators together
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                st = None
+
+            if st is None or not stat.S_ISREG(st.st_mode):
                 self._set_headers(status=404)
                 self.wfile.write(b"File not found")
                 return
 
-            mime_type, _ = mimetypes.guess_type(str(full_path))
-            if not mime_type:
-                mime_type = "application/octet-stream"
+            size = st.st_size
+            etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+            last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+
+            if self._not_modified(etag, st.st_mtime):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                return
+
+            # <video>/<audio> seek and download managers resume with Range
+            # requests; answer with just that slice
+            range_header = self.headers.get('Range')
+            if_range = self.headers.get('If-Range')
+            if range_header and if_range and if_range not in (etag, last_modified):
+                # The file changed since the client's partial copy: send it all
+                range_header = None
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
 
-            self.send_response(200)
-            self.send_header("Content-type", mime_type)
-            self.send_header("Content-Length", str(full_path.stat().st_size))
+            if byte_range:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                start, end = 0, size - 1
+                self.send_response(200)
+            self.send_header("Content-type", _guess_mime(full_path))
+            if attachment:
+                self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(full_path)}"')
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
             self.end_headers()
 
             with open(full_path, 'rb') as f:
-                shutil.copyfileobj(f, self.wfile)
+                self._send_file_body(f, start, end - start + 1, drop_cache=attachment)
         except Exception as e:
             self._set_headers(status=500)
             self.wfile.write(str(e).encode())
@@ -203,7 +1137,7 @@ class RyDriveHandler(BaseHTTPRequestHandler):
         """Create a new folder"""
         content_length = int(self.headers['Content-Length'])
         body = self.rfile.read(content_length)
-        data = json.loads(body.decode())
+        data = _loads(body)
 
         try:
             parent_path = data.get('path', '')
@@ -212,52 +1146,130 @@ class RyDriveHandler(BaseHTTPRequestHandler):
             if not folder_name:
                 raise ValueError("Folder name required")
 
-            full_path = self._get_full_path(parent_path) / folder_name
-            full_path.mkdir(parents=True, exist_ok=True)
+            # Resolve the joined path so the name itself can't climb out of DATA_DIR
+            full_path = self._get_full_path(os.path.join(parent_path, folder_name))
+            os.makedirs(full_path, exist_ok=True)
+            _realpath_in_root.cache_clear()
+            _list_cache_drop(os.path.dirname(full_path))
 
             self._set_headers("application/json")
-            self.wfile.write(json.dumps({"success": True}).encode())
+            self.wfile.write(_OK_JSON)
         except Exception as e:
             self._set_headers("application/json", 500)
-            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            self.wfile.write(_dumps({"error": str(e)}))
 
     def _delete_item(self):
         """Delete a file or folder"""
         content_length = int(self.headers['Content-Length'])
         body = self.rfile.read(content_length)
-        data = json.loads(body.decode())
+        data = _loads(body)
 
         try:
             rel_path = data.get('path', '')
             full_path = self._get_full_path(rel_path)
+            if full_path == _DATA_ROOT:
+                raise ValueError("Cannot delete the root folder")
 
-            if full_path.is_dir():
-                shutil.rmtree(full_path)
-            else:
-                full_path.unlink()
+            # A big rmtree can take minutes; hand it off and let the client poll
+            if os.path.isdir(full_path) and not _is_small_tree(full_path):
+                self._set_headers("application/json", 202)
+                self.wfile.write(_dumps({"job": _submit_delete(full_path)}))
+                return
+
+            _delete_path(full_path)
 
             self._set_headers("application/json")
-            self.wfile.write(json.dumps({"success": True}).encode())
+            self.wfile.write(_OK_JSON)
         except Exception as e:
             self._set_headers("application/json", 500)
-            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            self.wfile.write(_dumps({"error": str(e)}))
+
+    def _job_status(self, job_id):
+        """Report on a background delete: pending, done or error"""
+        with _JOBS_LOCK:
+            future = _JOBS.get(job_id)
+            if future is not None and future.done():
+                del _JOBS[job_id]
+
+        if future is None:
+            self._set_headers("application/json", 404)
+            self.wfile.write(_dumps({"error": "Unknown job"}))
+            return
+
+        if not future.done():
+            result = {"status": "pending"}
+        elif future.exception() is not None:
+            result = {"status": "error", "error": str(future.exception())}
+        else:
+            result = {"status": "done"}
+        self._set_headers("application/json")
+        self.wfile.write(_dumps(result))
 
     def log_message(self, format, *args):
         """Custom logging"""
-        print(f"[{self.date_time_string()}] {format % args}")
+        if _log.isEnabledFor(logging.INFO):
+            _log.info("[%s] " + format, self.date_time_string(), *args)
+
+
+class RyDriveServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer with a cap on concurrent request threads
+
+    Plain ThreadingHTTPServer starts a new thread per connection with no
+    upper limit; here at most HTTP_THREADS requests run at once and further
+    connections wait in the listen backlog until a slot frees up. The
+    handler's REQUEST_TIMEOUT keeps idle connections from holding slots
+    forever. Threads are daemonic so Ctrl-C doesn't wait for in-flight
+    transfers.
+    """
+
+    request_queue_size = 128
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, max_workers=HTTP_THREADS):
+        super().__init__(server_address, handler_class)
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
 
 
 def main():
     # Create data directory if it doesn't exist
-    Path(DATA_DIR).mkdir(exist_ok=True)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
 
     # Check if index.html exists
-    if not Path('index.html').exists():
+    if _INDEX_HTML is None:
         print("ERROR: index.html not found!")
         print("Please ensure index.html is in the same directory as rydrive.py")
         return
 
-    server = HTTPServer((HOST, PORT), RyDriveHandler)
+    # Load the system MIME tables now rather than lazily under the first requests
+    mimetypes.init()
+
+    # Reclaim whatever uploads interrupted by a previous crash left behind
+    _maybe_sweep_parts()
+
+    log_queue = queue.SimpleQueue()
+    _log.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log.setLevel(logging.INFO)
+    _log.propagate = False
+    log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    log_listener.start()
+
+    server = RyDriveServer((HOST, PORT), RyDriveHandler)
     print(f"""
     ========================================
             RyDrive Server Started
@@ -274,8 +1286,9 @@ def main():
     try:
         server.serve_forever()
     except KeyboardInterrupt:
+        server.server_close()
+        log_listener.stop()
         print("\n\nServer stopped. Goodbye!")
-        server.shutdown()
 
 
 if __name__ == "__main__":